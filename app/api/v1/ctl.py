@@ -1,18 +1,14 @@
 # app/api/v1/ctl.py
-from pathlib import Path
-import pandas as pd
-
 import logging
 from fastapi import APIRouter, UploadFile, File, Form
-from fastapi.responses import FileResponse
-from starlette.background import BackgroundTask
+from fastapi.responses import StreamingResponse
 
-from app.core.settings import sanitize_filename_component, OUTPUT_FOLDER
+from app.core.settings import sanitize_filename_component
 
 from app.services.generators import (
-    generar_archivo_control,
-    generar_script_sql,
-    build_zip,
+    render_control_file,
+    render_sql_script,
+    iter_zip,
     build_unique_zip_filename,
 )
 
@@ -21,16 +17,25 @@ logger = logging.getLogger("app.api.v1.ctl")
 router = APIRouter(tags=["ctl"])
 
 
-def load_dataframe_from_upload(file: UploadFile) -> pd.DataFrame:
+def _is_excel(file: UploadFile) -> bool:
+    return (file.filename or "").lower().endswith((".xlsx", ".xls"))
+
+def read_columns_and_dtypes(file: UploadFile, n: int = 1000) -> tuple[list[str], list[str]]:
     """
-    Carga CSV o Excel a DataFrame de manera simple.
-    Ajusta si en tu entorno solo usas CSV.
+    Retorna (columnas, tipos) del archivo con una sola lectura; los tipos se
+    infieren de las primeras `n` filas.
     """
-    filename = (file.filename or "").lower()
-    if filename.endswith(".xlsx") or filename.endswith(".xls"):
-        return pd.read_excel(file.file)
-    # default CSV
-    return pd.read_csv(file.file, encoding="latin-1")
+    # Import diferido: pandas solo se carga cuando se usa
+    import pandas as pd
+
+    # Columnas y tipos salen del mismo DataFrame (mismos nombres que asigna pandas).
+    # Con nrows, read_excel (openpyxl) abre el libro en read-only y deja de leer en la fila n.
+    file.file.seek(0)
+    if _is_excel(file):
+        df = pd.read_excel(file.file, nrows=n)
+    else:
+        df = pd.read_csv(file.file, encoding="latin-1", nrows=n)
+    return df.columns.tolist(), [str(dtype) for dtype in df.dtypes]
 
 @router.post("/ctl")
 def generar_ctl_endpoint(
@@ -38,42 +43,21 @@ def generar_ctl_endpoint(
     nombre_tabla: str = Form(...),
     delimitador: str = Form(...),
 ):
-    df = load_dataframe_from_upload(archivo)
-
-    columnas = list(df.columns)
-    tipos_datos = [str(dtype) for dtype in df.dtypes]
-
-    ruta_ctl = Path(generar_archivo_control(nombre_tabla, columnas, delimitador, archivo.filename))
-    ruta_sql = Path(generar_script_sql(nombre_tabla, columnas, tipos_datos))
+    columnas, tipos_datos = read_columns_and_dtypes(archivo)
 
-    zip_path = OUTPUT_FOLDER / build_unique_zip_filename(nombre_tabla)
+    zip_name = build_unique_zip_filename(nombre_tabla)
 
     safe_table = sanitize_filename_component(nombre_tabla, default="TABLA").upper()
-    build_zip(
-        zip_path,
-        [
-            (ruta_ctl, "carga.ctl"),
-            (ruta_sql, f"{safe_table}.sql"),
-        ],
-    )
-
-    def cleanup():
-        try:
-            ruta_ctl.unlink(missing_ok=True)
-        except Exception:
-            pass
-        try:
-            ruta_sql.unlink(missing_ok=True)
-        except Exception:
-            pass
-        try:
-            zip_path.unlink(missing_ok=True)
-        except Exception:
-            pass
-
-    return FileResponse(
-        path=str(zip_path),
-        filename=zip_path.name,
+    contenido_ctl = render_control_file(nombre_tabla, columnas, delimitador, archivo.filename)
+    contenido_sql = render_sql_script(nombre_tabla, columnas, tipos_datos)
+
+    return StreamingResponse(
+        iter_zip(
+            [
+                (contenido_ctl.encode("utf-8"), "carga.ctl"),
+                (contenido_sql.encode("utf-8"), f"{safe_table}.sql"),
+            ]
+        ),
         media_type="application/zip",
-        background=BackgroundTask(cleanup),
+        headers={"Content-Disposition": f'attachment; filename="{zip_name}"'},
     )
@@ -2,16 +2,17 @@
 from __future__ import annotations
 
 import os
-import re
 import string
-from pathlib import Path, PureWindowsPath
+from functools import lru_cache
 
 from fastapi import APIRouter, HTTPException, Query
 
 from app.core.settings import (
     BASE_DOCS_DIR,
-    _FORBIDDEN_EXPORT_CHARS,
+    _ABS_DRIVE_RE,
+    _SEP_SPLIT,
     _UNC_ADMIN_SHARE,
+    _has_forbidden_export_chars,
 )
 
 router = APIRouter(prefix="/fs", tags=["fs"])
@@ -27,14 +28,14 @@ def _fs_norm_dir(p: str) -> str:
     return s
 
 def _fs_has_traversal(p: str) -> bool:
-    parts = (p or "").replace("/", "\\").split("\\") if os.name == "nt" else (p or "").split("/")
+    parts = _SEP_SPLIT.split(p or "") if os.name == "nt" else (p or "").split("/")
     return any(x == ".." for x in parts)
 
 def _fs_is_abs_drive_or_unc(p: str) -> bool:
     if os.name != "nt":
         return (p or "").startswith("/")
     s = (p or "").strip()
-    return bool(re.match(r"^[A-Za-z]:[\\/]", s)) or s.startswith("\\\\")
+    return bool(_ABS_DRIVE_RE.match(s)) or s.startswith("\\\\")
 
 def _fs_default_deny_prefixes() -> list[str]:
     # Debe ser coherente con settings.py (puedes ajustar por env var igual que allá)
@@ -47,45 +48,68 @@ def _fs_default_deny_prefixes() -> list[str]:
         r"C:\System Volume Information\\",
     ]
 
-def _fs_load_deny_prefixes() -> list[str]:
-    raw = (os.getenv("SPOOL_DENY_PREFIXES") or "").strip()
+@lru_cache(maxsize=1)
+def _fs_deny_prefixes_norm_lc(raw: str) -> tuple[str, ...]:
+    # Cacheado por valor crudo de la env var: se recalcula solo si cambia
+    raw = raw.strip()
     prefixes = [p.strip() for p in raw.split(";") if p.strip()] if raw else _fs_default_deny_prefixes()
-    if os.name == "nt":
-        return [_fs_norm_dir(x) for x in prefixes]
-    return prefixes
+    return tuple(_fs_norm_dir(x).lower() for x in prefixes)
 
-def _fs_is_denied_by_prefix(path_abs: str) -> bool:
+def _fs_load_deny_prefixes() -> tuple[str, ...]:
+    return _fs_deny_prefixes_norm_lc(os.getenv("SPOOL_DENY_PREFIXES") or "")
+
+def _fs_is_denied_by_prefix(path_lc: str, prefixes: tuple[str, ...] | None = None) -> bool:
+    """
+    `path_lc` debe venir normalizado con _fs_norm_dir y en minúsculas.
+    """
     if os.name != "nt":
         return False
-    t = _fs_norm_dir(path_abs).lower()
-    for pref in _fs_load_deny_prefixes():
-        p = _fs_norm_dir(pref).lower()
-        if t.startswith(p):
-            return True
-    return False
+    # str.startswith acepta una tupla: compara todos los prefijos en C
+    return path_lc.startswith(_fs_load_deny_prefixes() if prefixes is None else prefixes)
 
 def _fs_parent(path_abs: str) -> str:
-    if os.name != "nt":
-        p = Path(path_abs.rstrip("/"))
-        parent = str(p.parent) + "/"
-        return parent if parent != "//" else "/"
-    p = PureWindowsPath(path_abs.rstrip("\\"))
-    parent = str(p.parent)
-    # para C:\ -> parent se queda C:\ (evitamos loops raros)
-    if re.match(r"^[A-Za-z]:$", parent):
-        parent += "\\"
-    return _fs_norm_dir(parent)
+    # path_abs ya viene normalizado (_fs_norm_dir): basta con cortar en el último separador
+    is_nt = os.name == "nt"
+    sep = "\\" if is_nt else "/"
+    s = path_abs.rstrip(sep)
+    # raíz UNC (\\server\share): no hay padre navegable
+    if is_nt and s.startswith("\\\\") and s.count("\\") <= 3:
+        return s + sep
+    i = s.rfind(sep)
+    # para C:\ -> parent se queda C:\ (evitamos loops raros); "/x" -> "/"
+    if i < 0:
+        return s + sep
+    if i == 0:
+        return sep
+    return s[:i] + sep
 
 def _fs_list_dirs(path_abs: str) -> list[dict]:
-    items = []
+    # path_abs ya viene normalizado (_fs_norm_dir), así que e.path usa el separador
+    # nativo y basta con agregar el separador final en cada hijo.
+    is_nt = os.name == "nt"
+    sep = "\\" if is_nt else "/"
+    prefixes = _fs_load_deny_prefixes() if is_nt else ()
+    # Columnas paralelas (SoA): evita un dict por entrada hasta el final
+    names: list[str] = []
+    paths: list[str] = []
+    denied: list[bool] = []
     with os.scandir(path_abs) as it:
         for e in it:
-            if e.is_dir(follow_symlinks=False):
-                child = _fs_norm_dir(e.path)
-                denied = _fs_is_denied_by_prefix(child) or (os.name == "nt" and child.startswith("\\\\") and _UNC_ADMIN_SHARE.match(child))
-                items.append({"name": e.name, "path": child, "denied": denied})
-    items.sort(key=lambda x: x["name"].lower())
-    return items
+            try:
+                if not e.is_dir(follow_symlinks=False):
+                    continue
+            except OSError:
+                continue
+            child = e.path if e.path.endswith(sep) else e.path + sep
+            names.append(e.name)
+            paths.append(child)
+            denied.append(
+                child.lower().startswith(prefixes)
+                or (is_nt and child.startswith("\\\\") and _UNC_ADMIN_SHARE.match(child) is not None)
+            )
+    keys = [n.lower() for n in names]
+    order = sorted(range(len(names)), key=keys.__getitem__)
+    return [{"name": names[i], "path": paths[i], "denied": denied[i]} for i in order]
 
 @router.get("/roots")
 def fs_roots():
@@ -111,7 +135,7 @@ def fs_list(path: str):
     if not p:
         raise HTTPException(status_code=400, detail="path es requerido.")
 
-    if _FORBIDDEN_EXPORT_CHARS.search(p):
+    if _has_forbidden_export_chars(p):
         raise HTTPException(status_code=400, detail="Ruta inválida: contiene caracteres no permitidos.")
     if _fs_has_traversal(p):
         raise HTTPException(status_code=400, detail="Ruta inválida: no se permite '..'.")
@@ -122,7 +146,7 @@ def fs_list(path: str):
         raise HTTPException(status_code=400, detail="Ruta inválida: debe ser absoluta (drive, UNC o /).")
 
     # bloqueos (navegación) por denylist / admin shares
-    if _fs_is_denied_by_prefix(p):
+    if _fs_is_denied_by_prefix(p.lower()):
         raise HTTPException(status_code=403, detail="Acceso denegado: ruta restringida por política.")
     if os.name == "nt" and p.startswith("\\\\") and _UNC_ADMIN_SHARE.match(p):
         raise HTTPException(status_code=403, detail="Acceso denegado: shares administrativos no permitidos.")
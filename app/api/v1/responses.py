@@ -0,0 +1,10 @@
+# app/api/v1/responses.py
+from fastapi.responses import JSONResponse
+
+# orjson (si está instalado) serializa en C y bastante más rápido que json.dumps;
+# si no, se mantiene el JSONResponse estándar.
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as APIJSONResponse
+except ImportError:
+    APIJSONResponse = JSONResponse
@@ -1,35 +1,100 @@
 # app/api/v1/spool.py
+import codecs
 import csv
+import itertools
+import re
+import shutil
 import tempfile
 from pathlib import Path
 from typing import Optional
 
 import logging
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
-from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse
 from starlette.background import BackgroundTask
 from sqlalchemy.exc import SQLAlchemyError
 
+from app.api.v1.responses import APIJSONResponse
 from app.core.settings import UPLOAD_FOLDER, normalize_export_path, sanitize_filename_component
 from app.db.engine import get_engine
-from app.db.sql_sample import normalize_sql, fetch_columns_from_query, fetch_preview_from_query
+from app.db.sql_sample import normalize_sql, fetch_columns_from_query, fetch_columns_and_preview
 from app.services.generators import generar_spool
 
 logger = logging.getLogger("app.api.v1.spool")
 
 router = APIRouter(tags=["spool"])
 
+# Copia de uploads a disco por bloques (memoria acotada sin importar el tamaño)
+_UPLOAD_COPY_CHUNK = 1 << 20
+# Lectura por bloques del upload para la cabecera y el preview
+_UPLOAD_PEEK_CHUNK = 1 << 16
 
-def read_sample_columns(path: Path) -> list[str]:
+# Fin de línea universal (\r\n, \r o \n), igual que open(..., newline="")
+_LINE_END = re.compile(r"\r\n|\r|\n")
+_LINE_END_BYTES = re.compile(rb"[\r\n]")
+
+
+def _iter_text_lines(binary, encoding: str = "latin-1"):
+    """
+    Decodifica un archivo binario por bloques y lo entrega línea a línea
+    (conservando el fin de línea) para csv.reader, aceptando archivos con
+    fin de línea solo-CR (Excel "CSV (Macintosh)").
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    # Solo se escanea el texto nuevo de cada bloque; la línea en curso se acumula
+    # por trozos (lineal aunque una línea ocupe muchos bloques)
+    parts: list[str] = []
+    held_cr = False
+    while True:
+        block = binary.read(_UPLOAD_PEEK_CHUNK)
+        final = not block
+        text = decoder.decode(block, final=final)
+        if held_cr:
+            text = "\r" + text
+            held_cr = False
+        start = 0
+        for m in _LINE_END.finditer(text):
+            # Un '\r' al final del bloque puede ser la mitad de un '\r\n'
+            if not final and m.end() == len(text) and m.group() == "\r":
+                held_cr = True
+                break
+            parts.append(text[start:m.end()])
+            yield "".join(parts)
+            parts.clear()
+            start = m.end()
+        rest = text[start:-1] if held_cr else text[start:]
+        if rest:
+            parts.append(rest)
+        if final:
+            if parts:
+                yield "".join(parts)
+            return
+
+def _copy_upload_peeking_header(src, dst) -> bytes:
+    """
+    Copia `src` en `dst` por bloques y retorna la primera línea (sin fin de
+    línea), que termina en el primer '\r' o '\n' (cubre \r\n, \n y solo-CR).
     """
-    Lee cabecera (primera línea) como columnas separadas por coma.
+    head = bytearray()
+    while True:
+        block = src.read(_UPLOAD_PEEK_CHUNK)
+        if not block:
+            break
+        dst.write(block)
+        # Solo se busca en el bloque nuevo: los anteriores no tenían fin de línea
+        line_end = _LINE_END_BYTES.search(block)
+        if line_end is not None:
+            head += block[:line_end.start()]
+            break
+        head += block
+    shutil.copyfileobj(src, dst, length=_UPLOAD_COPY_CHUNK)
+    return bytes(head)
+
+def parse_header_columns(first_line: str) -> list[str]:
     """
-    lines = path.read_text(encoding="latin-1", errors="replace").splitlines()
-    if not lines:
-        return []
-    first = lines[0]
-    cols = [c.strip() for c in first.split(",")]
+    Interpreta la cabecera (primera línea) como columnas separadas por coma.
+    """
+    cols = [c.strip() for c in first_line.split(",")]
     return [c for c in cols if c]
 
 @router.post("/spool")
@@ -43,18 +108,19 @@ def spool_endpoint(
 ):
     source_mode = (source_mode or "csv").strip().lower()
 
-    logger.info(
-        "spool_requested",
-        extra={
-            "event": "spool_requested",
-            "source_mode": source_mode,
-            "report_name": report_name,
-            "export_path_raw": export_path,
-            "table_name": table_name,
-            "sql_len": len(sql_query or "") if source_mode == "sql" else None,
-            "upload_filename": (file.filename if file else None),
-        },
-    )
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "spool_requested",
+            extra={
+                "event": "spool_requested",
+                "source_mode": source_mode,
+                "report_name": report_name,
+                "export_path_raw": export_path,
+                "table_name": table_name,
+                "sql_len": len(sql_query or "") if source_mode == "sql" else None,
+                "upload_filename": (file.filename if file else None),
+            },
+        )
 
     tmp_path: Optional[Path] = None
     output_path: Optional[Path] = None
@@ -70,25 +136,27 @@ def spool_endpoint(
             if suffix not in [".csv", ".txt"]:
                 raise HTTPException(status_code=400, detail="Sube un CSV (o TXT) para leer cabeceras.")
 
+            # Se toma la cabecera al vuelo mientras se copia, sin releer el archivo
             with tempfile.NamedTemporaryFile(delete=False, dir=UPLOAD_FOLDER, suffix=suffix) as tmp:
-                tmp.write(file.file.read())
+                header_line = _copy_upload_peeking_header(file.file, tmp)
                 tmp_path = Path(tmp.name)
-            
-            try:
-                sample_size = tmp_path.stat().st_size if tmp_path else None
-            except Exception:
-                sample_size = None
 
-            logger.info(
-                "sample_saved",
-                extra={
-                    "event": "sample_saved",
-                    "sample_tmp_path": str(tmp_path) if tmp_path else None,
-                    "sample_size_bytes": sample_size,
-                },
-            )
+            if logger.isEnabledFor(logging.INFO):
+                try:
+                    sample_size = tmp_path.stat().st_size if tmp_path else None
+                except Exception:
+                    sample_size = None
 
-            columns = read_sample_columns(tmp_path)
+                logger.info(
+                    "sample_saved",
+                    extra={
+                        "event": "sample_saved",
+                        "sample_tmp_path": str(tmp_path) if tmp_path else None,
+                        "sample_size_bytes": sample_size,
+                    },
+                )
+
+            columns = parse_header_columns(header_line.decode("latin-1", errors="replace"))
             if not columns:
                 raise HTTPException(status_code=400, detail="No se detectaron columnas en la cabecera del archivo.")
 
@@ -102,7 +170,7 @@ def spool_endpoint(
 
             try:
                 engine = get_engine()
-                columns = fetch_columns_from_query(engine, q, limit=100)
+                columns = fetch_columns_from_query(engine, q)
             except SQLAlchemyError as e:
                 logger.exception(
                     "sqlalchemy_error_fetch_columns",
@@ -115,7 +183,7 @@ def spool_endpoint(
                 raise HTTPException(
                     status_code=400,
                     detail=(
-                        "No se pudo ejecutar la consulta para obtener una muestra (100 filas). "
+                        "No se pudo ejecutar la consulta para obtener sus columnas. "
                         f"Revisa tu SQL. Detalle: {str(e).splitlines()[0]}"
                     ),
                 )
@@ -133,21 +201,22 @@ def spool_endpoint(
 
         output_path = Path(generar_spool(export_path, report_name, from_source, columns))
 
-        try:
-            out_size = output_path.stat().st_size if output_path else None
-        except Exception:
-            out_size = None
+        if logger.isEnabledFor(logging.INFO):
+            try:
+                out_size = output_path.stat().st_size if output_path else None
+            except Exception:
+                out_size = None
 
-        logger.info(
-            "spool_generated",
-            extra={
-                "event": "spool_generated",
-                "output_file": str(output_path) if output_path else None,
-                "output_size_bytes": out_size,
-                "columns_count": len(columns) if columns else 0,
-                "from_source_kind": "inline_view" if (source_mode == "sql") else "table_or_from",
-            },
-        )
+            logger.info(
+                "spool_generated",
+                extra={
+                    "event": "spool_generated",
+                    "output_file": str(output_path) if output_path else None,
+                    "output_size_bytes": out_size,
+                    "columns_count": len(columns) if columns else 0,
+                    "from_source_kind": "inline_view" if (source_mode == "sql") else "table_or_from",
+                },
+            )
 
         def cleanup():
             try:
@@ -185,67 +254,51 @@ def spool_preview(
     source_mode = (source_mode or "csv").strip().lower()
     preview_rows = max(1, min(int(preview_rows or 10), 100))
 
-    tmp_path: Optional[Path] = None
+    if source_mode == "csv":
+        if file is None or not (file.filename or "").strip():
+            raise HTTPException(status_code=400, detail="Selecciona un archivo CSV/TXT para preview.")
 
-    try:
-        if source_mode == "csv":
-            if file is None or not (file.filename or "").strip():
-                raise HTTPException(status_code=400, detail="Selecciona un archivo CSV/TXT para preview.")
+        suffix = Path(file.filename).suffix.lower()
+        if suffix not in [".csv", ".txt"]:
+            raise HTTPException(status_code=400, detail="Formato no soportado para preview. Usa CSV o TXT.")
 
-            suffix = Path(file.filename).suffix.lower()
-            if suffix not in [".csv", ".txt"]:
-                raise HTTPException(status_code=400, detail="Formato no soportado para preview. Usa CSV o TXT.")
-
-            with tempfile.NamedTemporaryFile(delete=False, dir=UPLOAD_FOLDER, suffix=suffix) as tmp:
-                tmp.write(file.file.read())
-                tmp_path = Path(tmp.name)
-
-            text_content = tmp_path.read_text(encoding="latin-1", errors="replace").splitlines()
-            if not text_content:
+        # Se parsea directo desde el upload (una sola pasada, sin archivo temporal)
+        try:
+            reader = csv.reader(_iter_text_lines(file.file, "latin-1"))
+            header = next(reader, None)
+            if header is None:
                 raise HTTPException(status_code=400, detail="El archivo está vacío.")
 
-            reader = csv.reader(text_content)
-            columns = [c.strip() for c in (next(reader, []) or [])]
+            columns = [c.strip() for c in header]
+            rows = list(itertools.islice(reader, preview_rows))
+        except csv.Error as e:
+            raise HTTPException(status_code=400, detail=f"No se pudo leer el CSV para preview. Detalle: {e}")
 
-            rows = []
-            for i, row in enumerate(reader):
-                if i >= preview_rows:
-                    break
-                rows.append(list(row))
-
-            return JSONResponse(
-                content=jsonable_encoder(
-                    {"mode": "csv", "columns": columns, "rows": rows, "row_count": len(rows)}
-                )
-            )
-
-        elif source_mode == "sql":
-            try:
-                q = normalize_sql(sql_query or "")
-            except ValueError as e:
-                raise HTTPException(status_code=400, detail=str(e))
+        # Payload ya es list[list[str]] + escalares: no requiere jsonable_encoder
+        return APIJSONResponse(
+            content={"mode": "csv", "columns": columns, "rows": rows, "row_count": len(rows)}
+        )
 
-            try:
-                engine = get_engine()
-                payload = fetch_preview_from_query(engine, q, limit=preview_rows)
-            except SQLAlchemyError as e:
-                raise HTTPException(
-                    status_code=400,
-                    detail=(
-                        "No se pudo ejecutar la consulta para preview. "
-                        f"Revisa tu SQL. Detalle: {str(e).splitlines()[0]}"
-                    ),
-                )
+    elif source_mode == "sql":
+        try:
+            q = normalize_sql(sql_query or "")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-            payload["mode"] = "sql"
-            return JSONResponse(content=payload)
+        try:
+            engine = get_engine()
+            payload = fetch_columns_and_preview(engine, q, limit=preview_rows)
+        except SQLAlchemyError as e:
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    "No se pudo ejecutar la consulta para preview. "
+                    f"Revisa tu SQL. Detalle: {str(e).splitlines()[0]}"
+                ),
+            )
 
-        else:
-            raise HTTPException(status_code=400, detail="source_mode inválido. Usa 'csv' o 'sql'.")
+        payload["mode"] = "sql"
+        return APIJSONResponse(content=payload)
 
-    finally:
-        try:
-            if tmp_path:
-                tmp_path.unlink(missing_ok=True)
-        except Exception:
-            pass
+    else:
+        raise HTTPException(status_code=400, detail="source_mode inválido. Usa 'csv' o 'sql'.")
@@ -1,22 +1,43 @@
 # app/core/observability.py
 from __future__ import annotations
 
+import atexit
+import copy
 import json
 import logging
 import os
+import queue
 import socket
+import time
 import traceback
 import uuid
 from contextvars import ContextVar
-from datetime import datetime, timezone
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 from typing import Any, Dict, Optional
 
 from app.core.settings import OUTPUT_FOLDER
 
+# orjson es opcional: si está instalado se usa para serializar los logs JSON
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 request_id_ctx: ContextVar[str] = ContextVar("request_id", default="-")
 
+# Constantes durante la vida del proceso: evita syscall/getenv por cada log.
+# _SERVICE se fija en setup_logging (después de cargar .env).
+_HOST = socket.gethostname()
+_SERVICE = "spool-ctl-generator"
+
+# Atributos estándar de LogRecord que no se copian como "extra"
+_RESERVED = frozenset({
+    "name", "msg", "args", "levelname", "levelno", "pathname", "filename", "module",
+    "exc_info", "exc_text", "stack_info", "lineno", "funcName", "created", "msecs",
+    "relativeCreated", "thread", "threadName", "processName", "process",
+})
+
 def get_request_id() -> str:
     return request_id_ctx.get()
 
@@ -30,24 +51,20 @@ class JsonFormatter(logging.Formatter):
     """
     def format(self, record: logging.LogRecord) -> str:
         base: Dict[str, Any] = {
-            "ts": datetime.now(timezone.utc).isoformat(),
+            # record.created ya lo capturó logging al emitir el evento
+            "ts": f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))}.{int(record.msecs):03d}Z",
             "level": record.levelname,
             "logger": record.name,
             "msg": record.getMessage(),
             "request_id": getattr(record, "request_id", get_request_id()),
-            "service": os.getenv("APP_NAME", "spool-ctl-generator"),
-            "host": socket.gethostname(),
+            "service": _SERVICE,
+            "host": _HOST,
         }
 
         # "extra" fields (los que pasas en logger.info(..., extra={...}))
         # Evita clonar todo el record; solo agrega campos “no estándar”.
-        reserved = {
-            "name", "msg", "args", "levelname", "levelno", "pathname", "filename", "module",
-            "exc_info", "exc_text", "stack_info", "lineno", "funcName", "created", "msecs",
-            "relativeCreated", "thread", "threadName", "processName", "process",
-        }
         for k, v in record.__dict__.items():
-            if k in reserved:
+            if k in _RESERVED:
                 continue
             if k.startswith("_"):
                 continue
@@ -61,7 +78,13 @@ class JsonFormatter(logging.Formatter):
                 "traceback": "".join(traceback.format_exception(*record.exc_info))[:20000],
             }
 
-        return json.dumps(base, ensure_ascii=False)
+        if orjson is not None:
+            try:
+                return orjson.dumps(base, default=str).decode("utf-8")
+            except orjson.JSONEncodeError:
+                # p.ej. enteros fuera de 64 bits: cae a json estándar
+                pass
+        return json.dumps(base, ensure_ascii=False, default=str)
 
 class RequestIdFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
@@ -69,12 +92,35 @@ class RequestIdFilter(logging.Filter):
             record.request_id = get_request_id()
         return True
 
+class _LocalQueueHandler(QueueHandler):
+    """
+    QueueHandler para una cola en el mismo proceso: no pre-formatea el record
+    (QueueHandler.prepare descarta exc_info), así JsonFormatter lo recibe completo.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+# Listener que escribe el archivo JSON en un hilo aparte (se guarda para poder detenerlo)
+_log_listener: Optional[QueueListener] = None
+
+def _stop_log_listener() -> None:
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
 def setup_logging() -> None:
     """
     Logging a:
       - consola (dev)
-      - archivo JSON rotativo (prod local)
+      - archivo JSON rotativo (prod local), escrito en un hilo aparte vía cola
     """
+    global _SERVICE, _log_listener
+    _SERVICE = os.getenv("APP_NAME", "spool-ctl-generator")
+
     level_str = (os.getenv("APP_LOG_LEVEL") or "INFO").upper()
     level = getattr(logging, level_str, logging.INFO)
 
@@ -89,6 +135,7 @@ def setup_logging() -> None:
     # Limpia handlers previos (uvicorn reload, etc.)
     for h in list(root.handlers):
         root.removeHandler(h)
+    _stop_log_listener()
 
     # Consola (human-readable)
     ch = logging.StreamHandler()
@@ -106,13 +153,23 @@ def setup_logging() -> None:
     )
     fh.setLevel(level)
     fh.setFormatter(JsonFormatter())
-    fh.addFilter(RequestIdFilter())
-    root.addHandler(fh)
+
+    # El request path solo encola; serialización + I/O ocurren en el listener.
+    # El filtro va en el QueueHandler: request_id vive en el contextvar del request.
+    qh = _LocalQueueHandler(queue.SimpleQueue())
+    qh.setLevel(level)
+    qh.addFilter(RequestIdFilter())
+    root.addHandler(qh)
+
+    _log_listener = QueueListener(qh.queue, fh, respect_handler_level=True)
+    _log_listener.start()
 
     # Reduce ruido de loggers comunes si lo deseas
     logging.getLogger("uvicorn.access").setLevel(os.getenv("UVICORN_ACCESS_LOG_LEVEL", "WARNING"))
     logging.getLogger("sqlalchemy.engine").setLevel(os.getenv("SQLALCHEMY_LOG_LEVEL", "WARNING"))
 
 
+atexit.register(_stop_log_listener)
+
 def new_request_id() -> str:
     return uuid.uuid4().hex
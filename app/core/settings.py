@@ -1,17 +1,56 @@
 # app/core/settings.py
 from __future__ import annotations
 
-from pathlib import Path, PureWindowsPath
+from functools import lru_cache
+from pathlib import Path
+import ntpath
 import os
 import re
 import unicodedata
 
 # Bloquea caracteres que rompen SPOOL o permiten comportamientos inesperados en SQL*Plus
-_FORBIDDEN_EXPORT_CHARS = re.compile(r'["\'\r\n\t&;|<>]')
+_FORBIDDEN_EXPORT_CHARS = '"\'\r\n\t&;|<>'
+# Tabla de translate que elimina esos caracteres (chequeo en una pasada en C)
+_FORBIDDEN_EXPORT_TABLE = str.maketrans("", "", _FORBIDDEN_EXPORT_CHARS)
 
 # Bloquea shares administrativos: \\server\C$\..., \\server\ADMIN$\...
 _UNC_ADMIN_SHARE = re.compile(r"^\\\\[^\\]+\\([a-zA-Z]\$|admin\$)\\", re.IGNORECASE)
 
+# Rutas absolutas con unidad (C:\ o C:/)
+_ABS_DRIVE_RE = re.compile(r"^[A-Za-z]:[\\/]")
+
+# Separa por cualquiera de los dos separadores en una sola pasada
+_SEP_SPLIT = re.compile(r"[\\/]")
+
+class _LazyTranslateTable(dict):
+    """
+    Tabla para str.translate que se completa bajo demanda: cada codepoint se
+    resuelve una sola vez con `mapper(ch) -> str | None` y queda cacheado.
+    """
+    def __init__(self, mapper):
+        super().__init__()
+        self._mapper = mapper
+
+    def __missing__(self, cp: int):
+        value = self._mapper(chr(cp))
+        self[cp] = value
+        return value
+
+def _filename_char(ch: str):
+    # Espacio -> '_', se mantiene a-zA-Z0-9_- y se elimina lo demás (incluidas marcas Mn tras NFD)
+    if ch == " ":
+        return "_"
+    if (ch.isascii() and ch.isalnum()) or ch in "_-":
+        return ch
+    return None
+
+# Sanitización de nombres de archivo
+_FILENAME_TABLE = _LazyTranslateTable(_filename_char)
+_MULTI_UNDERSCORE = re.compile(r"_{2,}")
+
+def _has_forbidden_export_chars(p: str) -> bool:
+    return len(p.translate(_FORBIDDEN_EXPORT_TABLE)) != len(p)
+
 def _home_dir() -> Path:
     return Path(os.environ.get("USERPROFILE") or os.environ.get("HOME") or ".")
 
@@ -31,21 +70,38 @@ OUTPUT_FOLDER = Path(os.environ.get("APP_OUTPUT_DIR") or (BASE_DOCS_DIR / "outpu
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
 
-def _norm_dir(p: str) -> str:
-    s = (p or "").strip().replace("/", "\\")
+def _normalize_once(p: str) -> tuple[str, str]:
+    """
+    Normaliza la ruta una sola vez y retorna (canónica, canónica en minúsculas):
+    backslash como separador, sin '.' ni separadores repetidos (ntpath.normpath)
+    y con trailing '\\'. No resuelve '..' (se valida antes con _has_traversal).
+    """
     # colapsa espacios finales que en Windows son problemáticos
-    s = s.rstrip()
-    if s and not s.endswith("\\"):
+    s = (p or "").strip()
+    if not s:
+        return "", ""
+    s = ntpath.normpath(s)
+    if not s.endswith("\\"):
         s += "\\"
-    return s
+    return s, s.lower()
 
 def _has_traversal(p: str) -> bool:
-    parts = _norm_dir(p).split("\\")
+    parts = _SEP_SPLIT.split((p or "").strip())
     return any(part == ".." for part in parts)
 
+def _has_trailing_dot_or_space_segment(p: str) -> bool:
+    # Win32 descarta '.' y espacios finales de cada segmento (C:\Windows.\ == C:\Windows\)
+    parts = _SEP_SPLIT.split((p or "").strip())
+    return any(part != "." and part[-1:] in (".", " ") for part in parts)
+
+def _has_stream_colon(p: str) -> bool:
+    # ':' fuera de la unidad (C:) abre streams NTFS: C:\Windows::$INDEX_ALLOCATION == C:\Windows
+    return (p or "").strip().find(":", 2) != -1
+
 def _is_abs_drive_or_unc(p: str) -> bool:
     s = (p or "").strip()
-    return bool(re.match(r"^[A-Za-z]:[\\/]", s)) or s.startswith("\\\\")
+    # UNC con cualquiera de los dos separadores (\\server, //server)
+    return bool(_ABS_DRIVE_RE.match(s)) or s[:2].replace("/", "\\") == "\\\\"
 
 def _default_deny_prefixes() -> list[str]:
     # Puedes ampliar/ajustar según políticas internas
@@ -58,29 +114,27 @@ def _default_deny_prefixes() -> list[str]:
         r"C:\System Volume Information\\",
     ]
 
-def _load_deny_prefixes() -> list[str]:
-    # Permite configuración por env var (separado por ;)
-    raw = (os.getenv("SPOOL_DENY_PREFIXES") or "").strip()
+@lru_cache(maxsize=1)
+def _deny_prefixes_norm_lc(raw: str) -> tuple[str, ...]:
+    # Cacheado por valor crudo de la env var: se recalcula solo si cambia
+    raw = raw.strip()
     if not raw:
         prefixes = _default_deny_prefixes()
     else:
         prefixes = [p.strip() for p in raw.split(";") if p.strip()]
 
-    # Normaliza a backslash y asegura trailing "\"
-    norm = []
-    for p in prefixes:
-        norm.append(_norm_dir(p))
-    return norm
+    # Misma normalización que la ruta a validar (backslash, trailing "\"), en minúsculas
+    return tuple(_normalize_once(p)[1] for p in prefixes)
 
-def _is_denied_by_prefix(path_abs: str) -> bool:
-    target = str(PureWindowsPath(_norm_dir(path_abs)))
-    t = target.lower()
+def _load_deny_prefixes() -> tuple[str, ...]:
+    # Permite configuración por env var (separado por ;)
+    return _deny_prefixes_norm_lc(os.getenv("SPOOL_DENY_PREFIXES") or "")
 
-    for pref in _load_deny_prefixes():
-        p = str(PureWindowsPath(_norm_dir(pref))).lower()
-        if t.startswith(p):
-            return True
-    return False
+def _is_denied_by_prefix(path_lc: str) -> bool:
+    """
+    `path_lc` debe venir de _normalize_once (forma en minúsculas).
+    """
+    return path_lc.startswith(_load_deny_prefixes())
 
 def _fs_validate_dir_writable(path_abs: str) -> None:
     """
@@ -113,14 +167,10 @@ def sanitize_filename_component(value: str, default: str = "archivo") -> str:
     if not s:
         return default
 
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
-
-    # Reemplaza espacios por guion bajo y remueve lo demás
-    s = s.replace(" ", "_")
-    s = re.sub(r"[^a-zA-Z0-9_\-]+", "", s)
+    # Una sola pasada en C sobre la forma NFD: quita tildes, espacios -> '_' y remueve lo demás
+    s = unicodedata.normalize("NFD", s).translate(_FILENAME_TABLE)
 
-    s = re.sub(r"_{2,}", "_", s).strip("_")
+    s = _MULTI_UNDERSCORE.sub("_", s).strip("_")
     return s or default
 
 def normalize_export_path(p: str) -> str:
@@ -129,6 +179,7 @@ def normalize_export_path(p: str) -> str:
     - Permite drive y UNC
     - Bloquea caracteres peligrosos para SQL*Plus (incluye '&')
     - Bloquea '..' (path traversal)
+    - Bloquea ':' fuera de la unidad y carpetas que terminan en '.' o espacio (alias Win32/NTFS)
     - Bloquea shares admin (\\server\\C$\\, \\server\\ADMIN$\\)
     - Bloquea rutas del sistema por lista negra (prefijos)
     - Normaliza a backslash y asegura trailing '\\'
@@ -137,7 +188,7 @@ def normalize_export_path(p: str) -> str:
     if not s:
         return s  # sigue siendo requerido por el formulario
 
-    if _FORBIDDEN_EXPORT_CHARS.search(s):
+    if _has_forbidden_export_chars(s):
         raise ValueError(
             "Ruta inválida: contiene caracteres no permitidos (comillas, saltos de línea, &, ;, etc.)."
         )
@@ -145,18 +196,25 @@ def normalize_export_path(p: str) -> str:
     if _has_traversal(s):
         raise ValueError("Ruta inválida: no se permite '..' en la ruta.")
 
-    s = _norm_dir(s)
+    if _has_stream_colon(s):
+        raise ValueError("Ruta inválida: no se permite ':' fuera de la unidad (streams NTFS).")
 
+    if _has_trailing_dot_or_space_segment(s):
+        raise ValueError("Ruta inválida: ninguna carpeta puede terminar en '.' o espacio.")
+
+    # Antes de normalizar: normpath convierte 'C:.' (relativa a la unidad) en 'C:\\'
     if not _is_abs_drive_or_unc(s):
         # En tu caso (local por usuario) conviene exigir absoluto para evitar ambigüedad
         raise ValueError("Ruta inválida: debe ser absoluta (C:\\... o \\\\servidor\\share\\...).")
 
+    s, s_lc = _normalize_once(s)
+
     # UNC admin shares: denegar
     if s.startswith("\\\\") and _UNC_ADMIN_SHARE.match(s):
         raise ValueError("Ruta inválida: no se permiten shares administrativos (C$, ADMIN$).")
 
     # Denylist por prefijo (Windows system dirs, etc.)
-    if _is_denied_by_prefix(s):
+    if _is_denied_by_prefix(s_lc):
         raise ValueError("Ruta inválida: no se permite exportar en rutas del sistema.")
 
     # Validación opcional de filesystem (recomendado en local)
@@ -1,15 +1,39 @@
 # app/db/sql_sample.py
 from __future__ import annotations
 
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
 from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
 from sqlalchemy.engine import Engine
 from fastapi.encoders import jsonable_encoder
 import re
 import logging
+import threading
 import time
 
 logger = logging.getLogger("app.sql")
 
+# Inicio de literal o comentario en estado normal
+_MASK_START = re.compile(r"['\"]|--|/\*")
+
+def _find_quote_end(sql: str, quote: str, i: int) -> int:
+    """
+    Retorna el índice siguiente al cierre del literal que empieza en `i`
+    (la comilla doble '' / "" es escape). Si no cierra, retorna len(sql).
+    """
+    j = i + 1
+    while True:
+        j = sql.find(quote, j)
+        if j == -1:
+            return len(sql)
+        if sql.startswith(quote, j + 1):
+            j += 2
+            continue
+        return j + 1
+
 def _mask_literals_and_comments(sql: str) -> str:
     """
     Devuelve una versión del SQL donde:
@@ -17,107 +41,64 @@ def _mask_literals_and_comments(sql: str) -> str:
       - los comentarios -- ... y /* ... */ se reemplazan por espacios
     Mantiene los caracteres fuera de literales/comentarios intactos.
     Esto permite detectar ';' y keywords prohibidas fuera de strings/comentarios.
+
+    Salta entre delimitadores con str.find / regex (en C) en vez de recorrer
+    carácter por carácter; cada tramo se copia o se rellena de una sola vez.
     """
     out = []
     i = 0
     n = len(sql)
 
-    in_squote = False
-    in_dquote = False
-    in_line_comment = False
-    in_block_comment = False
-
     while i < n:
-        ch = sql[i]
-        nxt = sql[i + 1] if i + 1 < n else ""
-
-        # Comentario de línea: -- hasta fin de línea
-        if in_line_comment:
-            if ch == "\n":
-                in_line_comment = False
-                out.append(ch)
-            else:
-                out.append(" ")
-            i += 1
-            continue
+        m = _MASK_START.search(sql, i)
+        if m is None:
+            out.append(sql[i:])
+            break
 
-        # Comentario de bloque: /* ... */
-        if in_block_comment:
-            if ch == "*" and nxt == "/":
-                in_block_comment = False
-                out.append(" ")
-                out.append(" ")
-                i += 2
-            else:
-                out.append(" ")
-                i += 1
-            continue
+        start = m.start()
+        if start > i:
+            out.append(sql[i:start])
 
-        # Dentro de string literal '...'
-        if in_squote:
-            # Manejo de escape Oracle/MySQL: '' representa comilla simple
-            if ch == "'" and nxt == "'":
-                out.append(" ")
-                out.append(" ")
-                i += 2
-                continue
-            if ch == "'":
-                in_squote = False
-                out.append(" ")
-                i += 1
-                continue
-            out.append(" ")
-            i += 1
-            continue
+        token = m.group(0)
+        if token == "--":
+            # Comentario de línea: -- hasta fin de línea (el salto se conserva)
+            end = sql.find("\n", start + 2)
+            if end == -1:
+                end = n
+        elif token == "/*":
+            # Comentario de bloque: /* ... */
+            end = sql.find("*/", start + 2)
+            end = n if end == -1 else end + 2
+        else:
+            # Literal '...' o identificador "..."
+            end = _find_quote_end(sql, token, start)
 
-        # Dentro de identificador "..."
-        if in_dquote:
-            # Manejo de escape: "" representa comilla doble
-            if ch == '"' and nxt == '"':
-                out.append(" ")
-                out.append(" ")
-                i += 2
-                continue
-            if ch == '"':
-                in_dquote = False
-                out.append(" ")
-                i += 1
-                continue
-            out.append(" ")
-            i += 1
-            continue
+        out.append(" " * (end - start))
+        i = end
 
-        # Entradas a comentarios
-        if ch == "-" and nxt == "-":
-            in_line_comment = True
-            out.append(" ")
-            out.append(" ")
-            i += 2
-            continue
-        if ch == "/" and nxt == "*":
-            in_block_comment = True
-            out.append(" ")
-            out.append(" ")
-            i += 2
-            continue
+    return "".join(out)
 
-        # Entradas a literales
-        if ch == "'":
-            in_squote = True
-            out.append(" ")
-            i += 1
-            continue
-        if ch == '"':
-            in_dquote = True
-            out.append(" ")
-            i += 1
-            continue
+# La sentencia debe iniciar con SELECT o WITH (se permiten paréntesis iniciales)
+_RE_STARTS_WITH_SELECT = re.compile(r"\s*\(*\s*(select|with)\b", re.IGNORECASE)
 
-        # Normal
-        out.append(ch)
-        i += 1
+# Keywords típicas de DDL/DML/ejecución
+_FORBIDDEN_KEYWORDS = frozenset({
+    "insert", "update", "delete", "merge", "drop", "alter", "create", "truncate", "grant", "revoke",
+    "commit", "rollback", "savepoint",
+    "call", "execute", "exec",
+    "begin", "declare",
+    "set", "use",
+})
 
-    return "".join(out)
+# Palabras del SQL (mismo criterio de límite que \b): cada keyword se resuelve con
+# un lookup en el frozenset, en tiempo lineal y sin backtracking entre alternativas
+_RE_WORD = re.compile(r"\w+")
+
+# Caracteres no ASCII que re.IGNORECASE iguala a letras ASCII (misma semántica que antes)
+_ASCII_CASE_FOLD = str.maketrans({"\u0130": "i", "\u0131": "i", "\u017f": "s", "\u212a": "k"})
+
+def _fold_word(word: str) -> str:
+    return word.lower() if word.isascii() else word.translate(_ASCII_CASE_FOLD).lower()
 
 def normalize_sql(sql: str) -> str:
     """
@@ -126,18 +107,38 @@ def normalize_sql(sql: str) -> str:
       2) La sentencia debe iniciar con SELECT o WITH (ignorando espacios, comentarios y '(' iniciales)
       3) Se bloquean keywords típicas de DDL/DML/ejecución (BEGIN/EXEC/CALL, etc.)
       4) Se bloquea SELECT ... INTO OUTFILE/DUMPFILE (MySQL/MariaDB) por seguridad
+
+    El resultado (o el error) se cachea por texto de la consulta: la UI suele
+    reenviar el mismo SQL (preview -> generar -> regenerar).
     """
-    s = (sql or "").strip()
+    normalized, error = _normalize_sql_cached(sql or "")
+    if error is not None:
+        raise ValueError(error)
+    return normalized
+
+def _normalize_sql_hit_ratio() -> Optional[float]:
+    info = _normalize_sql_cached.cache_info()
+    total = info.hits + info.misses
+    return round(info.hits / total, 3) if total else None
+
+@lru_cache(maxsize=256)
+def _normalize_sql_cached(sql: str) -> tuple[str, Optional[str]]:
+    try:
+        return _normalize_sql_uncached(sql), None
+    except ValueError as e:
+        return "", str(e)
+
+def _normalize_sql_uncached(sql: str) -> str:
+    s = sql.strip()
 
     # Quitar ';' final (común al copiar desde editores)
-    if s.endswith(";"):
+    if s[-1:] == ";":
         s = s[:-1].rstrip()
 
     if not s:
         raise ValueError("La consulta SQL está vacía.")
 
     masked = _mask_literals_and_comments(s)
-    masked_lower = masked.lower()
 
     # 1) Bloquear múltiples sentencias: ';' fuera de literales/comentarios
     if ";" in masked:
@@ -145,81 +146,159 @@ def normalize_sql(sql: str) -> str:
 
     # 2) Debe iniciar con SELECT o WITH (permitimos paréntesis iniciales)
     #    Ej: (SELECT ...) o WITH ... SELECT ...
-    if not re.match(r"^\s*\(*\s*(select|with)\b", masked_lower):
+    if not _RE_STARTS_WITH_SELECT.match(masked):
         raise ValueError("Solo se permiten consultas de lectura: SELECT o WITH ... SELECT.")
 
-    # 3) Bloqueo de keywords peligrosas fuera de strings/comentarios
-    forbidden = re.compile(
-        r"\b("
-        r"insert|update|delete|merge|drop|alter|create|truncate|grant|revoke|"
-        r"commit|rollback|savepoint|"
-        r"call|execute|exec|"
-        r"begin|declare|"
-        r"set|use"
-        r")\b",
-        re.IGNORECASE,
-    )
-    m = forbidden.search(masked)
-    if m:
-        raise ValueError(f"Consulta rechazada: contiene keyword no permitida '{m.group(0)}'.")
-
-    # 4) Riesgo específico MariaDB/MySQL: SELECT ... INTO OUTFILE/DUMPFILE
-    if re.search(r"\binto\s+(outfile|dumpfile)\b", masked_lower):
+    # 3) y 4) en una sola pasada sobre el SQL enmascarado. Una keyword prohibida
+    #    tiene prioridad sobre INTO OUTFILE/DUMPFILE (se corta en la primera).
+    into_outfile = False
+    prev_word, prev_end = "", 0
+    for m in _RE_WORD.finditer(masked):
+        word = _fold_word(m.group(0))
+        if word in _FORBIDDEN_KEYWORDS:
+            raise ValueError(f"Consulta rechazada: contiene keyword no permitida '{m.group(0)}'.")
+        # INTO seguido solo de espacios y luego OUTFILE/DUMPFILE
+        if (
+            not into_outfile
+            and prev_word == "into"
+            and (word == "outfile" or word == "dumpfile")
+            and masked[prev_end:m.start()].isspace()
+        ):
+            into_outfile = True
+        prev_word, prev_end = word, m.end()
+
+    if into_outfile:
         raise ValueError("Consulta rechazada: no se permite SELECT ... INTO OUTFILE/DUMPFILE.")
 
     return s
 
-def build_sample_sql(sql: str, dialect_name: str, limit: int = 100) -> str:
+@lru_cache(maxsize=256)
+def build_sample_sql(sql: str, dialect_name: str, limit: int = 100, metadata_only: bool = False) -> str:
     """
     Genera un wrapper para obtener una muestra de filas, sin “adivinar” columnas por parsing.
     - Oracle: ROWNUM
     - Otros: LIMIT
+    Con metadata_only=True usa límite 0: no viajan filas, pero el driver igual
+    expone la descripción de columnas (result.keys()).
     """
     dialect = (dialect_name or "").lower()
+    if metadata_only:
+        limit = 0
 
     if dialect in {"oracle", "oracledb", "cx_oracle"}:
         return f"SELECT * FROM (\n{sql}\n) q WHERE ROWNUM <= {int(limit)}"
     else:
         return f"SELECT * FROM (\n{sql}\n) q LIMIT {int(limit)}"
 
-def fetch_columns_from_query(engine: Engine, sql: str, limit: int = 100) -> list[str]:
+@lru_cache(maxsize=256)
+def _text_for(sample_sql: str) -> TextClause:
+    """
+    TextClause reutilizable por SQL de muestra: evita re-escanear bind params en
+    cada ejecución y mantiene estable la clave del compiled cache del dialecto.
+    """
+    return text(sample_sql)
+
+class _TTLCache:
+    """
+    LRU acotado con expiración por TTL. Thread-safe: los endpoints sync de
+    FastAPI corren en un threadpool y comparten el engine.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self._ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+# Columnas por (engine.url, SQL normalizado). normalize_sql bloquea DDL desde la app,
+# así que la app no puede dejar el cache obsoleto; el TTL cubre cambios externos.
+_columns_cache = _TTLCache(maxsize=512, ttl=60.0)
+
+# Tipos que el JSON response serializa tal cual (jsonable_encoder no los cambia)
+_JSON_NATIVE_TYPES = frozenset({str, int, float, bool, type(None)})
+
+def _rows_are_json_native(rows: list[list]) -> bool:
+    return all(type(v) in _JSON_NATIVE_TYPES for row in rows for v in row)
+
+def fetch_columns_from_query(engine: Engine, sql: str, cache: bool = True) -> list[str]:
+    """
+    Retorna los nombres de columnas de la consulta (cacheados por engine + SQL).
+    Es bloqueante (Engine sync): llamarla desde handlers `def`, que FastAPI
+    ejecuta en su threadpool; desde un `async def` usar run_in_threadpool.
+    """
     start = time.perf_counter()
+    cache_hit = False
     try:
         sql = normalize_sql(sql)
-        sample_sql = build_sample_sql(sql, engine.dialect.name, limit=limit)
+        cache_key = (str(engine.url), sql)
+        if cache:
+            cached = _columns_cache.get(cache_key)
+            if cached is not None:
+                cache_hit = True
+                return list(cached)
 
-        # Nota: ejecutamos la consulta (muestra) para que el driver nos devuelva metadata de columnas.
+        sample_sql = build_sample_sql(sql, engine.dialect.name, metadata_only=True)
+
+        # Nota: ejecutamos la consulta (sin filas) para que el driver nos devuelva metadata de columnas.
         with engine.connect() as conn:
-            result = conn.execute(text(sample_sql))
-            return list(result.keys())
+            result = conn.execute(_text_for(sample_sql))
+            columns = list(result.keys())
+
+        if cache:
+            _columns_cache.set(cache_key, tuple(columns))
+        return columns
     except Exception:
         logger.exception(
             "sql_exec_error",
             extra={
                 "event": "sql_exec_error",
                 "phase": "fetch_columns_from_query",
-                "limit": limit,
+                "limit": 0,  # metadata_only: la muestra corre con límite 0
                 "sql_len": len(sql),
             },
         )
         raise
     finally:
-        elapsed_ms = (time.perf_counter() - start) * 1000.0
-        logger.info(
-            "sql_exec_done",
-            extra={
-                "event": "sql_exec_done",
-                "phase": "fetch_columns_from_query",
-                "limit": limit,
-                "sql_len": len(sql),
-                "duration_ms": round(elapsed_ms, 2),
-            },
-        )
+        if logger.isEnabledFor(logging.INFO):
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            logger.info(
+                "sql_exec_done",
+                extra={
+                    "event": "sql_exec_done",
+                    "phase": "fetch_columns_from_query",
+                    "limit": 0,
+                    "sql_len": len(sql),
+                    "duration_ms": round(elapsed_ms, 2),
+                    "normalize_cache_hit_ratio": _normalize_sql_hit_ratio(),
+                    "columns_cache_hit": cache_hit,
+                },
+            )
 
-def fetch_preview_from_query(engine: Engine, sql: str, limit: int = 10) -> dict:
+def fetch_columns_and_preview(engine: Engine, sql: str, limit: int = 10) -> dict:
     """
-    Ejecuta una muestra limitada y retorna:
+    Ejecuta una sola muestra limitada y retorna columnas + filas:
       { "columns": [...], "rows": [[...], ...], "row_count": n }
+    Las columnas quedan en el cache de fetch_columns_from_query, así el /spool
+    posterior con el mismo SQL no vuelve a la base.
+    Bloqueante, igual que fetch_columns_from_query.
     """
     start = time.perf_counter()
     try:
@@ -227,31 +306,46 @@ def fetch_preview_from_query(engine: Engine, sql: str, limit: int = 10) -> dict:
         sample_sql = build_sample_sql(sql, engine.dialect.name, limit=limit)
 
         with engine.connect() as conn:
-            result = conn.execute(text(sample_sql))
+            result = conn.execute(_text_for(sample_sql))
             cols = list(result.keys())
             rows = [list(r) for r in result.fetchmany(limit)]
 
-        return jsonable_encoder({"columns": cols, "rows": rows, "row_count": len(rows)})
+        _columns_cache.set((str(engine.url), sql), tuple(cols))
+        payload = {"columns": cols, "rows": rows, "row_count": len(rows)}
+        # jsonable_encoder recorre cada valor: solo hace falta si hay fechas, Decimal, bytes, etc.
+        if _rows_are_json_native(rows):
+            return payload
+        return jsonable_encoder(payload)
     except Exception:
         logger.exception(
             "sql_exec_error",
             extra={
                 "event": "sql_exec_error",
-                "phase": "fetch_columns_from_query",
+                "phase": "fetch_columns_and_preview",
                 "limit": limit,
                 "sql_len": len(sql),
             },
         )
         raise
     finally:
-        elapsed_ms = (time.perf_counter() - start) * 1000.0
-        logger.info(
-            "sql_exec_done",
-            extra={
-                "event": "sql_exec_done",
-                "phase": "fetch_columns_from_query",
-                "limit": limit,
-                "sql_len": len(sql),
-                "duration_ms": round(elapsed_ms, 2),
-            },
-        )
+        if logger.isEnabledFor(logging.INFO):
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            logger.info(
+                "sql_exec_done",
+                extra={
+                    "event": "sql_exec_done",
+                    "phase": "fetch_columns_and_preview",
+                    "limit": limit,
+                    "sql_len": len(sql),
+                    "duration_ms": round(elapsed_ms, 2),
+                    "normalize_cache_hit_ratio": _normalize_sql_hit_ratio(),
+                },
+            )
+
+def fetch_preview_from_query(engine: Engine, sql: str, limit: int = 10) -> dict:
+    """
+    Ejecuta una muestra limitada y retorna:
+      { "columns": [...], "rows": [[...], ...], "row_count": n }
+    Se mantiene por compatibilidad: delega en fetch_columns_and_preview.
+    """
+    return fetch_columns_and_preview(engine, sql, limit=limit)
@@ -37,20 +37,21 @@ async def add_request_id_and_timing(request: Request, call_next):
     try:
         response = await call_next(request)
     finally:
-        elapsed_ms = (time.perf_counter() - start) * 1000.0
-        status_code = getattr(response, "status_code", 500)
-
-        logger.info(
-            "request_complete",
-            extra={
-                "event": "request_complete",
-                "method": request.method,
-                "path": request.url.path,
-                "status_code": status_code,
-                "duration_ms": round(elapsed_ms, 2),
-                "client": request.client.host if request.client else None,
-            },
-        )
+        if logger.isEnabledFor(logging.INFO):
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            status_code = getattr(response, "status_code", 500)
+
+            logger.info(
+                "request_complete",
+                extra={
+                    "event": "request_complete",
+                    "method": request.method,
+                    "path": request.url.path,
+                    "status_code": status_code,
+                    "duration_ms": round(elapsed_ms, 2),
+                    "client": request.client.host if request.client else None,
+                },
+            )
 
         request_id_ctx.reset(token)
 
@@ -1,58 +1,82 @@
 from pathlib import Path
+import os
 import zipfile
-import pandas as pd
 from datetime import datetime
-import uuid
 import unicodedata
-import re
 import logging
+import threading
+import time
 
 from app.core.observability import get_request_id
-from app.core.settings import UPLOAD_FOLDER, OUTPUT_FOLDER, sanitize_filename_component
+from app.core.settings import UPLOAD_FOLDER, OUTPUT_FOLDER, _LazyTranslateTable, sanitize_filename_component
 
 logger = logging.getLogger("app.generators")
 
+def _clean_text_char(ch: str):
+    # a-z -> A-Z, A-Z/0-9 se mantienen, espacio -> '_', otros espacios en blanco
+    # se mantienen y el resto (incluidas marcas Mn tras NFD) se elimina
+    if ch == " ":
+        return "_"
+    if ch.isascii() and ch.isalnum():
+        return ch.upper()
+    if ch.isspace():
+        return ch
+    return None
+
+_CLEAN_TEXT_TABLE = _LazyTranslateTable(_clean_text_char)
+
 def limpiar_texto_completo(texto):
-    texto = unicodedata.normalize('NFD', texto)
-    texto = ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
-    texto_limpio = re.sub(r'[^a-zA-Z0-9\s]', '', texto)
-    texto_limpio = texto_limpio.replace(" ", "_").upper()
-    
-    return texto_limpio
+    # Una sola pasada en C sobre la forma NFD (sin tildes, solo alfanumérico ASCII)
+    return unicodedata.normalize('NFD', texto).translate(_CLEAN_TEXT_TABLE)
+
+# Prefijo por segundo (se formatea una vez por segundo) + secuencia dentro del segundo
+_stamp_lock = threading.Lock()
+_stamp_sec = -1
+_stamp_prefix = ""
+_stamp_seq = 0
 
 def _unique_stamp() -> str:
-    return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    global _stamp_sec, _stamp_prefix, _stamp_seq
+    with _stamp_lock:
+        # El reloj se lee dentro del lock; si retrocede se sigue en el segundo actual
+        sec = int(time.time())
+        if sec > _stamp_sec:
+            _stamp_sec = sec
+            _stamp_prefix = time.strftime("%Y%m%d_%H%M%S", time.localtime(sec))
+            _stamp_seq = 0
+        else:
+            _stamp_seq += 1
+        return f"{_stamp_prefix}_{_stamp_seq:06d}"
+
+def _short_rand() -> str:
+    # 8 hex (32 bits aleatorios) directo de os.urandom, sin construir un UUID
+    return os.urandom(4).hex()
 
 def build_unique_sql_filename(report_name: str) -> str:
     base = sanitize_filename_component(report_name,default="reporte").lower()
     stamp = _unique_stamp()
-    rand = uuid.uuid4().hex[:8]
+    rand = _short_rand()
     return f"control_{base}_{stamp}_{rand}.sql"
 
 def build_unique_ctl_filename(table_name: str) -> str:
     base = sanitize_filename_component(table_name, default="tabla").lower()
     stamp = _unique_stamp()
-    rand = uuid.uuid4().hex[:8]
+    rand = _short_rand()
     return f"carga_{base}_{stamp}_{rand}.ctl"
 
 def build_unique_create_sql_filename(table_name: str) -> str:
     base = sanitize_filename_component(table_name, default="tabla").lower()
     stamp = _unique_stamp()
-    rand = uuid.uuid4().hex[:8]
+    rand = _short_rand()
     return f"create_{base}_{stamp}_{rand}.sql"
 
 def build_unique_zip_filename(table_name: str) -> str:
     base = sanitize_filename_component(table_name, default="tabla").lower()
     stamp = _unique_stamp()
-    rand = uuid.uuid4().hex[:8]
+    rand = _short_rand()
     return f"{base}_archivos_{stamp}_{rand}.zip"
 
-def _quote_oracle_identifier(ident: str) -> str:
-    ident = (ident or "").strip()
-    ident = ident.replace('"', '""')
-    return f'"{ident}"'
-
-def generar_archivo_control(nombre_tabla, columnas, delimitador, nombre_archivo_datos):
+def render_control_file(nombre_tabla, columnas, delimitador, nombre_archivo_datos) -> str:
     cols = ",\n".join(columnas)
     contenido_ctl = f"""
 OPTIONS (SKIP = 1)
@@ -66,11 +90,16 @@ TRAILING NULLCOLS
 {cols}
 )
 """
+    return contenido_ctl.strip()
+
+def generar_archivo_control(nombre_tabla, columnas, delimitador, nombre_archivo_datos):
     ruta_ctl = UPLOAD_FOLDER / build_unique_ctl_filename(nombre_tabla)
-    ruta_ctl.write_text(contenido_ctl.strip(), encoding="utf-8")
+    ruta_ctl.write_bytes(
+        render_control_file(nombre_tabla, columnas, delimitador, nombre_archivo_datos).encode("utf-8")
+    )
     return str(ruta_ctl)
 
-def generar_script_sql(nombre_tabla, columnas, tipos_datos):
+def render_sql_script(nombre_tabla, columnas, tipos_datos) -> str:
     columnas_sql = []
     for columna, tipo in zip(columnas, tipos_datos):
         t = (tipo or "").lower()
@@ -85,107 +114,152 @@ def generar_script_sql(nombre_tabla, columnas, tipos_datos):
         columnas_sql.append(f"{columna} {tipo_sql}")
 
     script_sql = f"CREATE TABLE {nombre_tabla} (\n" + ",\n".join(columnas_sql) + "\n);"
+    return script_sql.strip()
+
+def generar_script_sql(nombre_tabla, columnas, tipos_datos):
     ruta_sql = UPLOAD_FOLDER / build_unique_create_sql_filename(nombre_tabla)
-    ruta_sql.write_text(script_sql.strip(), encoding="utf-8")
+    ruta_sql.write_bytes(render_sql_script(nombre_tabla, columnas, tipos_datos).encode("utf-8"))
     return str(ruta_sql)
 
+# Bloque fijo del script SQL*Plus (entre la cabecera de trazabilidad y el SPOOL)
+_SPOOL_PREAMBLE = (
+    "SET LINESIZE 10000",
+    "SET ECHO OFF",
+    "SET TIMING OFF",
+    "SET PAGESIZE 0",
+    "SET TERMOUT OFF",
+    "SET FEEDBACK OFF",
+    "SET TRIMSPOOL ON",
+    "",
+    "WHENEVER SQLERROR EXIT 1;",
+    "",
+    "ALTER SESSION SET NLS_DATE_FORMAT = 'DD/MM/YYYY HH24:MI:SS';",
+    "ALTER SESSION SET NLS_TIMESTAMP_FORMAT = 'DD/MM/YYYY HH24:MI:SS.FF';",
+    "ALTER SESSION SET NLS_TIMESTAMP_TZ_FORMAT = 'DD/MM/YYYY HH24:MI:SS.FF TZH:TZM';",
+    "",
+    "COLUMN tm NEW_VALUE FILE_TIME NOPRINT",
+    "SELECT to_char(TRUNC(SYSDATE - 1), 'DDMMYYYY') tm FROM DUAL;",
+    "PROMPT &FILE_TIME",
+    "",
+)
+
 def generar_spool(export_path, report_name, from_source, columns):
     
+    # Una sola pasada: expresión del SELECT y header (identificador entre comillas dobles)
     pieces = []
+    header_parts = []
     for col in columns:
-        val = f"REPLACE(NVL(TO_CHAR(A.{col}), ''), '\"', '\"\"')"
-        pieces.append(f"'\"'||{val}||'\"'")
+        name = col if type(col) is str else str(col)
+        pieces.append(f"'\"'||REPLACE(NVL(TO_CHAR(A.{name}), ''), '\"', '\"\"')||'\"'")
+        header_parts.append('"' + name.strip().replace('"', '""') + '"')
 
     # Une columnas con coma
     select_clause = "||','||\n".join(pieces)
-
-    # Header con columnas (sin comillas)
-    header = ",".join([_quote_oracle_identifier(str(c)) for c in columns])
+    header = ",".join(header_parts)
 
     report_name = limpiar_texto_completo(report_name).lower()
 
     rid = get_request_id()
     generated_at = datetime.now().isoformat(timespec="seconds")
 
-    control_file_content = f"""
--- generated_by=spool-ctl-generator
--- request_id={rid}
--- generated_at={generated_at}
-
-SET LINESIZE 10000
-SET ECHO OFF
-SET TIMING OFF
-SET PAGESIZE 0
-SET TERMOUT OFF
-SET FEEDBACK OFF
-SET TRIMSPOOL ON
-
-WHENEVER SQLERROR EXIT 1;
-
-ALTER SESSION SET NLS_DATE_FORMAT = 'DD/MM/YYYY HH24:MI:SS';
-ALTER SESSION SET NLS_TIMESTAMP_FORMAT = 'DD/MM/YYYY HH24:MI:SS.FF';
-ALTER SESSION SET NLS_TIMESTAMP_TZ_FORMAT = 'DD/MM/YYYY HH24:MI:SS.FF TZH:TZM';
-
-COLUMN tm NEW_VALUE FILE_TIME NOPRINT
-SELECT to_char(TRUNC(SYSDATE - 1), 'DDMMYYYY') tm FROM DUAL;
-PROMPT &FILE_TIME
-
-SPOOL "{export_path}{report_name}_&FILE_TIME..csv"
-SELECT '{header}' FROM DUAL;
-SELECT
-{select_clause}
-FROM {from_source} A;
-
-SPOOL OFF;
-DISCONNECT;
-EXIT;
-""".strip()
+    # Se arma por partes y se codifica una sola vez (write_bytes evita el encoder de modo texto)
+    parts = [
+        "-- generated_by=spool-ctl-generator",
+        f"-- request_id={rid}",
+        f"-- generated_at={generated_at}",
+        "",
+    ]
+    parts.extend(_SPOOL_PREAMBLE)
+    parts.extend((
+        f'SPOOL "{export_path}{report_name}_&FILE_TIME..csv"',
+        f"SELECT '{header}' FROM DUAL;",
+        "SELECT",
+        select_clause,
+        f"FROM {from_source} A;",
+        "",
+        "SPOOL OFF;",
+        "DISCONNECT;",
+        "EXIT;",
+    ))
+    payload = "\n".join(parts).encode("utf-8")
+
     output_path = OUTPUT_FOLDER / build_unique_sql_filename(report_name)
-    output_path.write_text(control_file_content, encoding="utf-8")
-
-    try:
-        size_bytes = output_path.stat().st_size
-    except Exception:
-        size_bytes = None
-
-    logger.info(
-        "artifact_written",
-        extra={
-            "event": "artifact_written",
-            "artifact_type": "spool_sql",
-            "path": str(output_path),
-            "size_bytes": size_bytes,
-            "report_name": report_name,
-        },
-    )
+    output_path.write_bytes(payload)
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "artifact_written",
+            extra={
+                "event": "artifact_written",
+                "artifact_type": "spool_sql",
+                "path": str(output_path),
+                "size_bytes": len(payload),
+                "report_name": report_name,
+            },
+        )
 
     return str(output_path)
 
-def read_sample_columns(sample_path: Path) -> list[str]:
-    # Lee la cabecera como haces hoy (primera línea CSV)
-    first_line = sample_path.read_text(encoding="latin-1").splitlines()[0]
-    return [c.strip() for c in first_line.split(",")]
-
-def load_dataframe_from_upload(archivo):
-    name = (archivo.filename or "").lower()
-    content = archivo.file.read()
-
-    if name.endswith(".csv"):
-        # Replica tu comportamiento (latin-1)
-        from io import BytesIO
-        return pd.read_csv(BytesIO(content), encoding="latin-1")
-    elif name.endswith(".xlsx"):
-        from io import BytesIO
-        return pd.read_excel(BytesIO(content))
-    else:
-        raise ValueError("Formato no soportado. Usa CSV o XLSX.")
-
-def build_zip(zip_path: Path, files: list[Path]):
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+# Texto pequeño (CTL/SQL): comprimirlo no compensa el costo de zlib
+_ZIP_STORE_MAX_BYTES = 256 * 1024
+_ZIP_DEFLATE_LEVEL = 1
+
+def _zip_compression_for(size: int) -> int:
+    return zipfile.ZIP_STORED if size < _ZIP_STORE_MAX_BYTES else zipfile.ZIP_DEFLATED
+
+class _ZipChunkWriter:
+    """
+    Destino no-seekable para ZipFile: acumula lo escrito para que
+    iter_zip lo entregue por bloques (zipfile usa data descriptors).
+    """
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip(files: list, chunk_size: int = 1 << 16):
+    """
+    Genera un ZIP al vuelo (bytes por bloques) sin escribir el archivo a disco.
+    `files` acepta Path, (Path, arcname) o (bytes, arcname) para contenido
+    ya generado en memoria.
+    Miembros pequeños van sin comprimir (ZIP_STORED); el resto con deflate nivel 1.
+    """
+    out = _ZipChunkWriter()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED, compresslevel=_ZIP_DEFLATE_LEVEL) as zf:
         for item in files:
             if isinstance(item, (tuple, list)) and len(item) == 2:
-                path, arcname = item
-                zf.write(str(path), arcname=str(arcname))
+                source, arcname = item
+            else:
+                source, arcname = item, Path(item).name
+
+            if isinstance(source, bytes):
+                zf.writestr(str(arcname), source, compress_type=_zip_compression_for(len(source)))
+            elif os.path.getsize(source) < _ZIP_STORE_MAX_BYTES:
+                zf.writestr(str(arcname), Path(source).read_bytes(), compress_type=zipfile.ZIP_STORED)
             else:
-                path = item
-                zf.write(str(path), arcname=Path(path).name)
+                with open(source, "rb") as src, zf.open(str(arcname), "w") as dst:
+                    while True:
+                        block = src.read(chunk_size)
+                        if not block:
+                            break
+                        dst.write(block)
+                        data = out.drain()
+                        if data:
+                            yield data
+            data = out.drain()
+            if data:
+                yield data
+    data = out.drain()
+    if data:
+        yield data